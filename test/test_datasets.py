@@ -11,6 +11,7 @@ import random
 import shutil
 import string
 import unittest
+import unittest.mock
 import xml.etree.ElementTree as ET
 import zipfile
 
@@ -21,6 +22,7 @@ import pytest
 import torch
 import torch.nn.functional as F
 from torchvision import datasets
+from torchvision.datasets import _optical_flow
 
 
 class STL10TestCase(datasets_utils.ImageDatasetTestCase):
@@ -1930,6 +1932,112 @@ class SintelTestCase(datasets_utils.ImageDatasetTestCase):
             for _, _, flow in dataset:
                 assert flow is None
 
+    def test_cache_images(self):
+        with self.create_dataset(split="train", cache_images="disk") as (dataset, _):
+            expected_imgs = [
+                tuple(np.asarray(dataset._read_img(file_name)) for file_name in pair) for pair in dataset._image_list
+            ]
+
+            # The first pass fills the cache
+            for index in range(len(dataset)):
+                img1, img2, _ = dataset[index]
+                assert isinstance(img1, PIL.Image.Image) and isinstance(img2, PIL.Image.Image)
+            assert all(os.path.exists(f"{path}.npy") for pair in dataset._image_list for path in pair)
+
+            # The second pass reads from the cache only, without decoding the images again
+            with unittest.mock.patch.object(dataset, "_read_img", side_effect=AssertionError("image was decoded")):
+                for index in range(len(dataset)):
+                    img1, img2, _ = dataset[index]
+                    np.testing.assert_array_equal(np.asarray(img1), expected_imgs[index][0])
+                    np.testing.assert_array_equal(np.asarray(img2), expected_imgs[index][1])
+
+    def test_file_listing_cache(self):
+        with self.create_dataset(split="train", pass_name="clean") as (dataset, _):
+            num_examples = len(dataset)
+            scene_dir = os.path.join(dataset.root, "Sintel", "training", "clean", "scene_0")
+
+            # Listings of directories that weren't modified recently are cached
+            old_mtime = os.stat(scene_dir).st_mtime - 60
+            os.utime(scene_dir, (old_mtime, old_mtime))
+            datasets.Sintel(dataset.root, split="train", pass_name="clean")
+            with unittest.mock.patch("os.scandir", side_effect=AssertionError("directory was scanned")):
+                _optical_flow._list_files(scene_dir, ".png")
+
+            # Adding or removing a file changes the mtime of the directory, which invalidates the cache. We keep the
+            # mtime in the past so that the cache is still used instead of bypassed for recently modified directories.
+            new_image = os.path.join(scene_dir, "frame_0009.png")
+            shutil.copy(os.path.join(scene_dir, "frame_0000.png"), new_image)
+            os.utime(scene_dir, (old_mtime + 1, old_mtime + 1))
+            assert len(datasets.Sintel(dataset.root, split="train", pass_name="clean")) == num_examples + 1
+
+            os.remove(new_image)
+            os.utime(scene_dir, (old_mtime + 2, old_mtime + 2))
+            assert len(datasets.Sintel(dataset.root, split="train", pass_name="clean")) == num_examples
+
+    def test_concurrent_reads(self):
+        with self.create_dataset(split="train", concurrent_reads=True) as (dataset, _):
+            for index, (img1, img2, _) in enumerate(dataset):
+                expected_img1, expected_img2 = (dataset._read_img(path) for path in dataset._image_list[index])
+                np.testing.assert_array_equal(np.asarray(img1), np.asarray(expected_img1))
+                np.testing.assert_array_equal(np.asarray(img2), np.asarray(expected_img2))
+
+    def test_pack_flows(self):
+        h, w = self.FLOW_H, self.FLOW_W
+        expected_flow = np.arange(2 * h * w).reshape(h, w, 2).transpose(2, 0, 1)
+        with self.create_dataset(split="train", pass_name="both", pack_flows=True) as (dataset, _):
+            assert os.path.exists(dataset._packed_flows_file)
+            for _, _, flow in dataset:
+                assert flow.shape == (2, h, w)
+                np.testing.assert_allclose(flow, expected_flow)
+
+            # The pack is re-used by new instances
+            mtime = os.path.getmtime(dataset._packed_flows_file)
+            dataset = datasets.Sintel(dataset.root, split="train", pack_flows=True)
+            assert os.path.getmtime(dataset._packed_flows_file) == mtime
+            np.testing.assert_allclose(dataset[0][2], expected_flow)
+
+    def test_pack_flows_different_files(self):
+        h, w = self.FLOW_H, self.FLOW_W
+        with self.create_dataset(split="train", pack_flows=True) as (dataset, _):
+            # Replace scene_0 by a scene_9 with as many flows, but of a different shape. The new .flo files are made
+            # older than the pack, so only the list of packed files tells that the pack is out of date.
+            sintel_root = os.path.join(dataset.root, "Sintel")
+            old_scene_dir = os.path.join(sintel_root, "training", "flow", "scene_0")
+            new_scene_dir = os.path.join(sintel_root, "training", "flow", "scene_9")
+            os.makedirs(new_scene_dir)
+            for file_name in os.listdir(old_scene_dir):
+                new_file_name = os.path.join(new_scene_dir, file_name)
+                datasets_utils.make_fake_flo_file(h=h, w=w + 1, file_name=new_file_name)
+                os.utime(new_file_name, (0, 0))
+            shutil.rmtree(old_scene_dir)
+            for pass_name in ("clean", "final"):
+                image_root = os.path.join(sintel_root, "training", pass_name)
+                os.rename(os.path.join(image_root, "scene_0"), os.path.join(image_root, "scene_9"))
+
+            dataset = datasets.Sintel(dataset.root, split="train", pack_flows=True)
+            for file_name in dataset._flow_list:
+                np.testing.assert_allclose(dataset._read_flow(file_name), _optical_flow._read_flo(file_name))
+
+    def test_pack_flows_failure(self):
+        h, w = self.FLOW_H, self.FLOW_W
+        with self.create_dataset(split="train") as (dataset, _):
+            training_root = os.path.join(dataset.root, "Sintel", "training")
+
+            # If the pack can't be written, we fall back to reading the .flo files
+            with unittest.mock.patch(
+                "torchvision.datasets._optical_flow._pack_flo_files", side_effect=PermissionError("read-only")
+            ):
+                with pytest.warns(UserWarning, match="Could not pack the flows"):
+                    dataset = datasets.Sintel(dataset.root, split="train", pack_flows=True)
+            assert dataset[0][2].shape == (2, h, w)
+
+            # A corrupted .flo file makes packing fail without leaving temporary files behind
+            with open(dataset._flow_list[-1], "r+b") as f:
+                f.truncate(20)
+            with pytest.raises(ValueError):
+                datasets.Sintel(dataset.root, split="train", pack_flows=True)
+            assert not [file_name for file_name in os.listdir(training_root) if file_name.startswith("flows_packed")]
+
     def test_bad_input(self):
         with pytest.raises(ValueError, match="Unknown value 'bad' for argument split"):
             with self.create_dataset(split="bad"):
@@ -1939,6 +2047,10 @@ class SintelTestCase(datasets_utils.ImageDatasetTestCase):
             with self.create_dataset(pass_name="bad"):
                 pass
 
+        with pytest.raises(ValueError, match="Unknown value 'bad' for argument cache_images"):
+            with self.create_dataset(cache_images="bad"):
+                pass
+
 
 class KittiFlowTestCase(datasets_utils.ImageDatasetTestCase):
     DATASET_CLASS = datasets.KittiFlow
@@ -2054,6 +2166,37 @@ class FlyingChairsTestCase(datasets_utils.ImageDatasetTestCase):
                 assert flow.shape == (2, h, w)
                 np.testing.assert_allclose(flow, expected_flow)
 
+    def test_split_file_too_short(self):
+        with self.create_dataset(split="train") as (dataset, _):
+            split_file = os.path.join(dataset.root, "FlyingChairs", "FlyingChairs_train_val.txt")
+            with open(split_file) as f:
+                split_ids = f.readlines()
+            with open(split_file, "w") as f:
+                f.writelines(split_ids[:-1])
+
+            with pytest.raises(ValueError, match="FlyingChairs_train_val.txt only has"):
+                datasets.FlyingChairs(dataset.root, split="train")
+
+    def test_malformed_split_file(self):
+        with self.create_dataset(split="train") as (dataset, _):
+            split_file = os.path.join(dataset.root, "FlyingChairs", "FlyingChairs_train_val.txt")
+            with open(split_file) as f:
+                split_ids = f.readlines()
+            split_ids[1] = "x\n"
+            with open(split_file, "w") as f:
+                f.writelines(split_ids)
+
+            with pytest.raises(ValueError, match="Could not parse .*FlyingChairs_train_val.txt"):
+                datasets.FlyingChairs(dataset.root, split="train")
+
+    def test_ppm_images(self):
+        # Make sure the .ppm images are decoded like PIL would
+        with self.create_dataset(split="train") as (dataset, _):
+            for index, (img1, img2, _) in enumerate(dataset):
+                for img, file_name in zip((img1, img2), dataset._image_list[index]):
+                    assert img.mode == "RGB"
+                    np.testing.assert_array_equal(np.asarray(img), np.asarray(PIL.Image.open(file_name)))
+
 
 class FlyingThings3DTestCase(datasets_utils.ImageDatasetTestCase):
     DATASET_CLASS = datasets.FlyingThings3D
@@ -2168,6 +2311,13 @@ class HD1KTestCase(KittiFlowTestCase):
         num_examples_per_sequence = num_examples_per_train_sequence if config["split"] == "train" else 2
         return num_sequences * (num_examples_per_sequence - 1)
 
+    def test_missing_images(self):
+        # A sequence with fewer images than flows must not shift the flows of the following sequences
+        with self.create_dataset(split="train") as (dataset, _):
+            os.remove(os.path.join(dataset.root, "hd1k", "hd1k_input", "image_2", "000000_2.png"))
+            with pytest.raises(IndexError):
+                datasets.HD1K(dataset.root, split="train")
+
 
 class EuroSATTestCase(datasets_utils.ImageDatasetTestCase):
     DATASET_CLASS = datasets.EuroSAT
@@ -1,7 +1,12 @@
+import functools
 import itertools
 import os
 import re
+import struct
+import time
+import warnings
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 from glob import glob
 from pathlib import Path
 
@@ -23,26 +28,79 @@ __all__ = (
 )
 
 
+# Thread used to read img2 while img1 is read when concurrent_reads=True. It is created lazily in each process (e.g. in
+# each DataLoader worker), as the threads of a pool inherited through fork() would not be running.
+_io_pool = None
+_io_pool_pid = None
+
+
+def _get_io_pool():
+    global _io_pool, _io_pool_pid
+    if _io_pool is None or _io_pool_pid != os.getpid():
+        _io_pool = ThreadPoolExecutor(max_workers=1)
+        _io_pool_pid = os.getpid()
+    return _io_pool
+
+
 class FlowDataset(ABC, VisionDataset):
     # Some datasets like Kitti have a built-in valid_flow_mask, indicating which flow values are valid
     # For those we return (img1, img2, flow, valid_flow_mask), and for the rest we return (img1, img2, flow),
     # and it's up to whatever consumes the dataset to decide what valid_flow_mask should be.
     _has_builtin_flow_mask = False
 
-    def __init__(self, root, transforms=None):
+    def __init__(self, root, transforms=None, cache_images=None, concurrent_reads=False):
 
         super().__init__(root=root)
         self.transforms = transforms
 
+        if cache_images is not None:
+            # There is deliberately no in-memory cache: each DataLoader worker would hold its own copy of it, which is
+            # discarded at the end of every epoch unless persistent_workers=True.
+            verify_str_arg(cache_images, "cache_images", valid_values=("disk",))
+        self._cache_images = cache_images
+        self._concurrent_reads = concurrent_reads
+
         self._flow_list = []
+        # List of (img1, img2) file name pairs. Tuples are smaller than lists and are immutable.
         self._image_list = []
 
     def _read_img(self, file_name):
+        # The datasets are documented to return PIL images, and the reference transforms expect them. We therefore
+        # don't decode with torchvision.io here, which besides can't decode the .ppm images of FlyingChairs.
         img = Image.open(file_name)
+        # PIL decodes lazily: force the decoding here so that it happens in the thread reading the image
+        img.load()
         if img.mode != "RGB":
             img = img.convert("RGB")
         return img
 
+    def _load_img(self, file_name):
+        # Read an image through _read_img(), going through the decoded image cache if cache_images is set.
+        if self._cache_images is None:
+            return self._read_img(file_name)
+        return Image.fromarray(self._load_img_from_disk_cache(file_name))
+
+    def _load_img_from_disk_cache(self, file_name):
+        cache_file_name = f"{file_name}.npy"
+        try:
+            if os.path.getmtime(cache_file_name) >= os.path.getmtime(file_name):
+                return np.load(cache_file_name)
+        except (OSError, ValueError):
+            # The cache file doesn't exist yet or is corrupted, e.g. because it was only partially written
+            pass
+
+        img = np.asarray(self._read_img(file_name))
+        try:
+            # Write to a temporary file first so that concurrent workers never read a partially written cache file
+            tmp_file_name = f"{cache_file_name}.{os.getpid()}.tmp"
+            with open(tmp_file_name, "wb") as f:
+                np.save(f, img)
+            os.replace(tmp_file_name, cache_file_name)
+        except OSError:
+            # We may not have write permissions on the dataset directory. The cache is best-effort.
+            pass
+        return img
+
     @abstractmethod
     def _read_flow(self, file_name):
         # Return the flow or a tuple with the flow and the valid_flow_mask if _has_builtin_flow_mask is True
@@ -50,12 +108,24 @@ class FlowDataset(ABC, VisionDataset):
 
     def __getitem__(self, index):
 
-        img1 = self._read_img(self._image_list[index][0])
-        img2 = self._read_img(self._image_list[index][1])
+        # Attributes used more than once are looked up only once, as this is on the hot path of data loading
+        img1_file, img2_file = self._image_list[index]
+        flow_list = self._flow_list
+        has_builtin_flow_mask = self._has_builtin_flow_mask
+
+        if self._concurrent_reads:
+            # img2 is read in a background thread while img1 is read in the current one. Decoding releases the GIL,
+            # so both decodings overlap.
+            img2_future = _get_io_pool().submit(self._load_img, img2_file)
+            img1 = self._load_img(img1_file)
+            img2 = img2_future.result()
+        else:
+            img1 = self._load_img(img1_file)
+            img2 = self._load_img(img2_file)
 
-        if self._flow_list:  # it will be empty for some dataset when split="test"
-            flow = self._read_flow(self._flow_list[index])
-            if self._has_builtin_flow_mask:
+        if flow_list:  # it will be empty for some dataset when split="test"
+            flow = self._read_flow(flow_list[index])
+            if has_builtin_flow_mask:
                 flow, valid_flow_mask = flow
             else:
                 valid_flow_mask = None
@@ -65,7 +135,7 @@ class FlowDataset(ABC, VisionDataset):
         if self.transforms is not None:
             img1, img2, flow, valid_flow_mask = self.transforms(img1, img2, flow, valid_flow_mask)
 
-        if self._has_builtin_flow_mask or valid_flow_mask is not None:
+        if has_builtin_flow_mask or valid_flow_mask is not None:
             # The `or valid_flow_mask is not None` part is here because the mask can be generated within a transform
             return img1, img2, flow, valid_flow_mask
         else:
@@ -117,28 +187,62 @@ class Sintel(FlowDataset):
             ``img1, img2, flow, valid_flow_mask`` and returns a transformed version.
             ``valid_flow_mask`` is expected for consistency with other datasets which
             return a built-in valid mask, such as :class:`~torchvision.datasets.KittiFlow`.
+        cache_images (string, optional): If ``"disk"``, the decoded images are saved as ``.npy`` files next to the
+            original images the first time they are read, and loaded from there afterwards, so that e.g. PNG decoding
+            only happens during the first epoch. The dataset directory must be writable for the cache to be used.
+            Default is None (no caching).
+        concurrent_reads (bool, optional): If True, ``img2`` is read and decoded in a background thread while
+            ``img1`` is read in the calling one. This can speed up data loading when there are fewer DataLoader
+            workers than CPU cores, but oversubscribes the CPU otherwise. Default is False.
+        pack_flows (bool, optional): If True, all the flows of the train split are packed into a single
+            ``training/flows_packed.npy`` file the first time the dataset is instantiated. The flows are then read from
+            a memory-map of that file instead of opening one .flo file per sample. If the pack can't be written, e.g.
+            because the dataset directory isn't writable, a warning is raised and the .flo files are read instead.
+            Default is False.
     """
 
-    def __init__(self, root, split="train", pass_name="clean", transforms=None):
-        super().__init__(root=root, transforms=transforms)
+    def __init__(
+        self,
+        root,
+        split="train",
+        pass_name="clean",
+        transforms=None,
+        cache_images=None,
+        concurrent_reads=False,
+        pack_flows=False,
+    ):
+        super().__init__(root=root, transforms=transforms, cache_images=cache_images, concurrent_reads=concurrent_reads)
 
         verify_str_arg(split, "split", valid_values=("train", "test"))
         verify_str_arg(pass_name, "pass_name", valid_values=("clean", "final", "both"))
         passes = ["clean", "final"] if pass_name == "both" else [pass_name]
 
-        root = Path(root) / "Sintel"
-        flow_root = root / "training" / "flow"
+        # We work with str paths and os.path.join() rather than with Path objects, as these are built in a loop
+        root = os.path.join(root, "Sintel")
+        flow_root = os.path.join(root, "training", "flow")
 
         for pass_name in passes:
             split_dir = "training" if split == "train" else split
-            image_root = root / split_dir / pass_name
+            image_root = os.path.join(root, split_dir, pass_name)
             for scene in os.listdir(image_root):
-                image_list = sorted(glob(str(image_root / scene / "*.png")))
-                for i in range(len(image_list) - 1):
-                    self._image_list += [[image_list[i], image_list[i + 1]]]
+                image_list = _list_files(os.path.join(image_root, scene), ".png")[0]
+                self._image_list.extend(zip(image_list[:-1], image_list[1:]))
 
                 if split == "train":
-                    self._flow_list += sorted(glob(str(flow_root / scene / "*.flo")))
+                    self._flow_list.extend(_list_files(os.path.join(flow_root, scene), ".flo")[0])
+
+        self._packed_flows_file = None
+        self._packed_flows = None
+        if pack_flows and self._flow_list:
+            packed_flows_file = os.path.join(root, "training", "flows_packed.npy")
+            try:
+                self._packed_flow_files, self._packed_flow_shapes = _pack_flo_files(self._flow_list, packed_flows_file)
+            except OSError as e:
+                # Like for cache_images, packing is best-effort: e.g. the dataset directory may not be writable
+                warnings.warn(f"Could not pack the flows into {packed_flows_file}, reading the .flo files instead: {e}")
+            else:
+                self._packed_flows_file = packed_flows_file
+                self._packed_flow_indices = {file_name: i for i, file_name in enumerate(self._packed_flow_files)}
 
     def __getitem__(self, index):
         """Return example at given index.
@@ -156,7 +260,20 @@ class Sintel(FlowDataset):
         return super().__getitem__(index)
 
     def _read_flow(self, file_name):
-        return _read_flo(file_name)
+        if self._packed_flows_file is None:
+            return _read_flo(file_name)
+
+        if self._packed_flows is None:
+            # Opened lazily, so that each DataLoader worker maps the file itself instead of receiving a pickled copy
+            self._packed_flows = np.load(self._packed_flows_file, mmap_mode="c")
+        index = self._packed_flow_indices[file_name]
+        h, w = self._packed_flow_shapes[index]
+        return np.asarray(self._packed_flows[index, :, :h, :w])
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_packed_flows"] = None
+        return state
 
 
 class KittiFlow(FlowDataset):
@@ -177,29 +294,34 @@ class KittiFlow(FlowDataset):
         split (string, optional): The dataset split, either "train" (default) or "test"
         transforms (callable, optional): A function/transform that takes in
             ``img1, img2, flow, valid_flow_mask`` and returns a transformed version.
+        cache_images (string, optional): If ``"disk"``, the decoded images are saved as ``.npy`` files next to the
+            original images the first time they are read, and loaded from there afterwards, so that e.g. PNG decoding
+            only happens during the first epoch. The dataset directory must be writable for the cache to be used.
+            Default is None (no caching).
+        concurrent_reads (bool, optional): If True, ``img2`` is read and decoded in a background thread while
+            ``img1`` is read in the calling one. This can speed up data loading when there are fewer DataLoader
+            workers than CPU cores, but oversubscribes the CPU otherwise. Default is False.
     """
 
     _has_builtin_flow_mask = True
 
-    def __init__(self, root, split="train", transforms=None):
-        super().__init__(root=root, transforms=transforms)
+    def __init__(self, root, split="train", transforms=None, cache_images=None, concurrent_reads=False):
+        super().__init__(root=root, transforms=transforms, cache_images=cache_images, concurrent_reads=concurrent_reads)
 
         verify_str_arg(split, "split", valid_values=("train", "test"))
 
         root = Path(root) / "KittiFlow" / (split + "ing")
-        images1 = sorted(glob(str(root / "image_2" / "*_10.png")))
-        images2 = sorted(glob(str(root / "image_2" / "*_11.png")))
+        images1, images2 = _list_files(root / "image_2", "_10.png", "_11.png")
 
         if not images1 or not images2:
             raise FileNotFoundError(
                 "Could not find the Kitti flow images. Please make sure the directory structure is correct."
             )
 
-        for img1, img2 in zip(images1, images2):
-            self._image_list += [[img1, img2]]
+        self._image_list = list(zip(images1, images2))
 
         if split == "train":
-            self._flow_list = sorted(glob(str(root / "flow_occ" / "*_10.png")))
+            self._flow_list = _list_files(root / "flow_occ", "_10.png")[0]
 
     def __getitem__(self, index):
         """Return example at given index.
@@ -244,16 +366,22 @@ class FlyingChairs(FlowDataset):
             ``img1, img2, flow, valid_flow_mask`` and returns a transformed version.
             ``valid_flow_mask`` is expected for consistency with other datasets which
             return a built-in valid mask, such as :class:`~torchvision.datasets.KittiFlow`.
+        cache_images (string, optional): If ``"disk"``, the decoded images are saved as ``.npy`` files next to the
+            original images the first time they are read, and loaded from there afterwards, so that e.g. PNG decoding
+            only happens during the first epoch. The dataset directory must be writable for the cache to be used.
+            Default is None (no caching).
+        concurrent_reads (bool, optional): If True, ``img2`` is read and decoded in a background thread while
+            ``img1`` is read in the calling one. This can speed up data loading when there are fewer DataLoader
+            workers than CPU cores, but oversubscribes the CPU otherwise. Default is False.
     """
 
-    def __init__(self, root, split="train", transforms=None):
-        super().__init__(root=root, transforms=transforms)
+    def __init__(self, root, split="train", transforms=None, cache_images=None, concurrent_reads=False):
+        super().__init__(root=root, transforms=transforms, cache_images=cache_images, concurrent_reads=concurrent_reads)
 
         verify_str_arg(split, "split", valid_values=("train", "val"))
 
         root = Path(root) / "FlyingChairs"
-        images = sorted(glob(str(root / "data" / "*.ppm")))
-        flows = sorted(glob(str(root / "data" / "*.flo")))
+        images, flows = _list_files(root / "data", ".ppm", ".flo")
 
         split_file_name = "FlyingChairs_train_val.txt"
 
@@ -262,12 +390,17 @@ class FlyingChairs(FlowDataset):
                 "The FlyingChairs_train_val.txt file was not found - please download it from the dataset page (see docstring)."
             )
 
-        split_list = np.loadtxt(str(root / split_file_name), dtype=np.int32)
-        for i in range(len(flows)):
-            split_id = split_list[i]
-            if (split == "train" and split_id == 1) or (split == "val" and split_id == 2):
-                self._flow_list += [flows[i]]
-                self._image_list += [[images[2 * i], images[2 * i + 1]]]
+        split_file = os.path.abspath(root / split_file_name)
+        split_list = _call_cached_by_mtime(_load_chairs_split, split_file)
+        if len(split_list) < len(flows):
+            raise ValueError(
+                f"{split_file_name} only has {len(split_list)} entries, but {len(flows)} flows were found. "
+                "Please make sure the split file matches the data directory."
+            )
+        split_id = 1 if split == "train" else 2
+        indices = np.flatnonzero(split_list[: len(flows)] == split_id).tolist()
+        self._flow_list = [flows[i] for i in indices]
+        self._image_list = [(images[2 * i], images[2 * i + 1]) for i in indices]
 
     def __getitem__(self, index):
         """Return example at given index.
@@ -284,6 +417,10 @@ class FlyingChairs(FlowDataset):
         """
         return super().__getitem__(index)
 
+    def _read_img(self, file_name):
+        img = _read_ppm(file_name) if file_name.endswith(".ppm") else None
+        return img if img is not None else super()._read_img(file_name)
+
     def _read_flow(self, file_name):
         return _read_flo(file_name)
 
@@ -315,10 +452,26 @@ class FlyingThings3D(FlowDataset):
             ``img1, img2, flow, valid_flow_mask`` and returns a transformed version.
             ``valid_flow_mask`` is expected for consistency with other datasets which
             return a built-in valid mask, such as :class:`~torchvision.datasets.KittiFlow`.
+        cache_images (string, optional): If ``"disk"``, the decoded images are saved as ``.npy`` files next to the
+            original images the first time they are read, and loaded from there afterwards, so that e.g. PNG decoding
+            only happens during the first epoch. The dataset directory must be writable for the cache to be used.
+            Default is None (no caching).
+        concurrent_reads (bool, optional): If True, ``img2`` is read and decoded in a background thread while
+            ``img1`` is read in the calling one. This can speed up data loading when there are fewer DataLoader
+            workers than CPU cores, but oversubscribes the CPU otherwise. Default is False.
     """
 
-    def __init__(self, root, split="train", pass_name="clean", camera="left", transforms=None):
-        super().__init__(root=root, transforms=transforms)
+    def __init__(
+        self,
+        root,
+        split="train",
+        pass_name="clean",
+        camera="left",
+        transforms=None,
+        cache_images=None,
+        concurrent_reads=False,
+    ):
+        super().__init__(root=root, transforms=transforms, cache_images=cache_images, concurrent_reads=concurrent_reads)
 
         verify_str_arg(split, "split", valid_values=("train", "test"))
         split = split.upper()
@@ -354,10 +507,10 @@ class FlyingThings3D(FlowDataset):
                 flows = sorted(glob(str(flow_dir / "*.pfm")))
                 for i in range(len(flows) - 1):
                     if direction == "into_future":
-                        self._image_list += [[images[i], images[i + 1]]]
+                        self._image_list += [(images[i], images[i + 1])]
                         self._flow_list += [flows[i]]
                     elif direction == "into_past":
-                        self._image_list += [[images[i + 1], images[i]]]
+                        self._image_list += [(images[i + 1], images[i])]
                         self._flow_list += [flows[i + 1]]
 
     def __getitem__(self, index):
@@ -398,29 +551,38 @@ class HD1K(FlowDataset):
         split (string, optional): The dataset split, either "train" (default) or "test"
         transforms (callable, optional): A function/transform that takes in
             ``img1, img2, flow, valid_flow_mask`` and returns a transformed version.
+        cache_images (string, optional): If ``"disk"``, the decoded images are saved as ``.npy`` files next to the
+            original images the first time they are read, and loaded from there afterwards, so that e.g. PNG decoding
+            only happens during the first epoch. The dataset directory must be writable for the cache to be used.
+            Default is None (no caching).
+        concurrent_reads (bool, optional): If True, ``img2`` is read and decoded in a background thread while
+            ``img1`` is read in the calling one. This can speed up data loading when there are fewer DataLoader
+            workers than CPU cores, but oversubscribes the CPU otherwise. Default is False.
     """
 
     _has_builtin_flow_mask = True
 
-    def __init__(self, root, split="train", transforms=None):
-        super().__init__(root=root, transforms=transforms)
+    def __init__(self, root, split="train", transforms=None, cache_images=None, concurrent_reads=False):
+        super().__init__(root=root, transforms=transforms, cache_images=cache_images, concurrent_reads=concurrent_reads)
 
         verify_str_arg(split, "split", valid_values=("train", "test"))
 
-        root = Path(root) / "hd1k"
+        root = os.path.join(root, "hd1k")
         if split == "train":
+            # Each directory is listed once, and the files are then grouped by sequence
+            flows_per_seq = _group_by_sequence(_list_files(os.path.join(root, "hd1k_flow_gt", "flow_occ"), ".png")[0])
+            images_per_seq = _group_by_sequence(_list_files(os.path.join(root, "hd1k_input", "image_2"), ".png")[0])
             # There are 36 "sequences" and we don't want seq i to overlap with seq i + 1, so we need this for loop
             for seq_idx in range(36):
-                flows = sorted(glob(str(root / "hd1k_flow_gt" / "flow_occ" / f"{seq_idx:06d}_*.png")))
-                images = sorted(glob(str(root / "hd1k_input" / "image_2" / f"{seq_idx:06d}_*.png")))
-                for i in range(len(flows) - 1):
-                    self._flow_list += [flows[i]]
-                    self._image_list += [[images[i], images[i + 1]]]
+                seq = f"{seq_idx:06d}_"
+                flows, images = flows_per_seq.get(seq, []), images_per_seq.get(seq, [])
+                # The flows and the image pairs are built from the same indices, so that a sequence with missing
+                # images raises an IndexError instead of silently misaligning all the following sequences
+                self._flow_list.extend(flows[i] for i in range(len(flows) - 1))
+                self._image_list.extend((images[i], images[i + 1]) for i in range(len(flows) - 1))
         else:
-            images1 = sorted(glob(str(root / "hd1k_challenge" / "image_2" / "*10.png")))
-            images2 = sorted(glob(str(root / "hd1k_challenge" / "image_2" / "*11.png")))
-            for image1, image2 in zip(images1, images2):
-                self._image_list += [[image1, image2]]
+            images1, images2 = _list_files(os.path.join(root, "hd1k_challenge", "image_2"), "10.png", "11.png")
+            self._image_list = list(zip(images1, images2))
 
         if not self._image_list:
             raise FileNotFoundError(
@@ -446,29 +608,212 @@ class HD1K(FlowDataset):
         return super().__getitem__(index)
 
 
+def _group_by_sequence(file_names):
+    # Group sorted HD1K file names by their "<sequence index>_" prefix, i.e. the first 7 characters of the basename
+    groups = {}
+    for file_name in file_names:
+        groups.setdefault(os.path.basename(file_name)[:7], []).append(file_name)
+    return groups
+
+
+def _list_files(directory, *suffixes):
+    """Return, for each suffix, the sorted paths of the files in ``directory`` ending with that suffix.
+
+    This is equivalent to calling ``sorted(glob(os.path.join(directory, "*" + suffix)))`` for each suffix, but the
+    directory is only scanned once and os.scandir() avoids the pattern matching overhead of glob, which matters for
+    directories with tens of thousands of files like the one of FlyingChairs.
+    """
+    try:
+        listing = _call_cached_by_mtime(_scan_dir, os.path.abspath(directory), suffixes)
+    except FileNotFoundError:
+        return [[] for _ in suffixes]
+    return [list(files) for files in listing]
+
+
+# Filesystem timestamps are coarse, so a change made right after a cached read may not change the mtime. Paths
+# modified more recently than this are therefore not cached.
+_MTIME_CACHE_MIN_AGE_NS = 2 * 10 ** 9
+
+
+def _call_cached_by_mtime(cached_func, path, *args):
+    # The modification time of path is part of the cache key, so that modifying the file or adding or removing files in
+    # the directory invalidates the cache
+    mtime = os.stat(path).st_mtime_ns
+    if time.time_ns() - mtime < _MTIME_CACHE_MIN_AGE_NS:
+        return cached_func.__wrapped__(path, mtime, *args)
+    return cached_func(path, mtime, *args)
+
+
+# Listings are cached so that instantiating several splits or passes of a dataset in the same process only scans each
+# directory once.
+@functools.lru_cache(maxsize=256)
+def _scan_dir(directory, mtime, suffixes):
+    files = {suffix: [] for suffix in suffixes}
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.name.startswith("."):  # glob ignores hidden files
+                continue
+            for suffix in suffixes:
+                if entry.name.endswith(suffix):
+                    files[suffix].append(entry.path)
+                    break
+    return tuple(tuple(sorted(files[suffix])) for suffix in suffixes)
+
+
+@functools.lru_cache(maxsize=16)
+def _load_chairs_split(file_name, mtime):
+    # np.fromstring in text mode parses the whitespace-separated values in C, in a single pass over the file content.
+    # It is faster than np.loadtxt on the ~23k lines of the file and gives the same result.
+    with open(file_name) as f:
+        content = f.read()
+    with warnings.catch_warnings():
+        # On malformed input, np.fromstring doesn't raise: it warns and returns the values parsed before the bad token
+        warnings.simplefilter("ignore", DeprecationWarning)
+        split_list = np.fromstring(content, dtype=np.int32, sep=" ")
+    if len(split_list) != len(content.split()):
+        raise ValueError(f"Could not parse {file_name}: it should only contain integers, one per line.")
+    # The array is shared by all the instances using the same file, so we make sure it can't be modified
+    split_list.setflags(write=False)
+    return split_list
+
+
+def _pack_flo_files(flo_files, packed_file_name):
+    """Pack .flo files into a single .npy file of shape (N, 2, H_max, W_max), padded with zeros.
+
+    The shapes of the flows and the names of the packed files, relative to the directory of the pack, are stored next
+    to it in ``_shapes.npy`` and ``_files.npy`` files. The packed file is only (re)written if it doesn't exist, if it
+    was built from a different set of files, or if it is older than one of the .flo files. Returns the sorted list of
+    packed files and their shapes.
+    """
+    flo_files = sorted(set(flo_files))
+    packed_root = os.path.dirname(packed_file_name)
+    relative_flo_files = np.array([os.path.relpath(f, packed_root) for f in flo_files], dtype=str)
+    shapes_file_name = packed_file_name[: -len(".npy")] + "_shapes.npy"
+    files_file_name = packed_file_name[: -len(".npy")] + "_files.npy"
+
+    try:
+        packed_mtime = os.path.getmtime(packed_file_name)
+        shapes = np.load(shapes_file_name)
+        # Rows are looked up by position, so the pack can only be re-used if it contains exactly the same files
+        if np.array_equal(np.load(files_file_name), relative_flo_files) and all(
+            os.path.getmtime(f) <= packed_mtime for f in flo_files
+        ):
+            return flo_files, shapes
+    except (OSError, ValueError):
+        pass
+
+    shapes = []
+    for flo_file in flo_files:
+        with open(flo_file, "rb") as f:
+            w, h = _parse_flo_header(f.read(12))
+        shapes.append((h, w))
+    shapes = np.array(shapes, dtype=np.int64)
+    h_max, w_max = shapes.max(axis=0)
+
+    # We write to temporary files first so that a partially written pack is never used
+    tmp_file_name = f"{packed_file_name}.{os.getpid()}.tmp"
+    tmp_shapes_file_name = f"{shapes_file_name}.{os.getpid()}.tmp"
+    tmp_files_file_name = f"{files_file_name}.{os.getpid()}.tmp"
+    try:
+        packed = np.lib.format.open_memmap(
+            tmp_file_name, mode="w+", dtype=np.float32, shape=(len(flo_files), 2, h_max, w_max)
+        )
+        try:
+            for i, (f, (h, w)) in enumerate(zip(flo_files, shapes)):
+                packed[i, :, :h, :w] = _read_flo(f)
+            packed.flush()
+        finally:
+            del packed
+
+        with open(tmp_shapes_file_name, "wb") as f:
+            np.save(f, shapes)
+        with open(tmp_files_file_name, "wb") as f:
+            np.save(f, relative_flo_files)
+        os.replace(tmp_shapes_file_name, shapes_file_name)
+        os.replace(tmp_files_file_name, files_file_name)
+        os.replace(tmp_file_name, packed_file_name)
+    finally:
+        # The temporary files only still exist if something went wrong, e.g. a corrupted .flo file or a full disk.
+        # The pack can be several GB, so we don't leave it behind in the dataset directory.
+        for file_name in (tmp_file_name, tmp_shapes_file_name, tmp_files_file_name):
+            try:
+                os.remove(file_name)
+            except FileNotFoundError:
+                pass
+
+    return flo_files, shapes
+
+
 def _read_flo(file_name):
-    """Read .flo file in Middlebury format"""
+    """Read .flo file in Middlebury format
+
+    The flow is stored interleaved, i.e. with shape (H, W, 2). It is returned with shape (2, H, W) like the other
+    flows, as a transposed view of the data read from the file: no extra copy is made.
+    """
     # Code adapted from:
     # http://stackoverflow.com/questions/28013200/reading-middlebury-flow-files-with-python-bytes-array-numpy
     # Everything needs to be in little Endian according to
     # https://vision.middlebury.edu/flow/code/flow-code/README.txt
     with open(file_name, "rb") as f:
-        magic = np.fromfile(f, "c", count=4).tobytes()
-        if magic != b"PIEH":
-            raise ValueError("Magic number incorrect. Invalid .flo file")
+        # Read the whole file at once: a single read is much faster than one np.fromfile() call per field.
+        # We read into a bytearray so that the returned flow is writable. We don't memory-map the file, as every flow
+        # kept alive would then also keep a file descriptor open.
+        content = bytearray(os.fstat(f.fileno()).st_size)
+        f.readinto(content)
+
+    w, h = _parse_flo_header(content)
+    data = np.frombuffer(content, "<f4", count=2 * w * h, offset=12)
+    return data.reshape(h, w, 2).transpose(2, 0, 1)
+
+
+def _parse_flo_header(header):
+    """Return the (width, height) from the first 12 bytes of a .flo file."""
+    # The header is parsed with struct rather than with numpy, which avoids creating arrays for 3 scalars. The magic
+    # number is the float 202021.25 which, in little endian, is the byte string b"PIEH".
+    if len(header) < 12:
+        raise ValueError("File too short. Invalid .flo file")
+    magic, w, h = struct.unpack("<4sii", header[:12])
+    if magic != b"PIEH":
+        raise ValueError("Magic number incorrect. Invalid .flo file")
+    return w, h
+
+
+# Header of a binary PPM: the magic number, width, height and maximum value, separated by whitespace and possibly
+# comments, followed by a single whitespace character. See http://netpbm.sourceforge.net/doc/ppm.html
+_PPM_SEPARATOR = rb"(?:\s|#[^\r\n]*[\r\n])+"
+_PPM_HEADER_RE = re.compile(rb"P6" + rb"".join(_PPM_SEPARATOR + rb"(\d+)" for _ in range(3)) + rb"\s")
+
+
+def _read_ppm(file_name):
+    """Read an 8-bit binary .ppm image, as used by FlyingChairs, into an RGB PIL image.
+
+    Binary PPM is just a short ASCII header followed by the raw RGB bytes, so we read the file at once, parse the
+    header and pass a view of the pixels to PIL, skipping its generic decoding machinery. Returns None if the file
+    isn't an 8-bit binary PPM, in which case the caller should fall back to PIL.
+    """
+    with open(file_name, "rb") as f:
+        content = f.read()
+
+    header_match = _PPM_HEADER_RE.match(content)
+    if not header_match:
+        return None
+    w, h, max_value = (int(value) for value in header_match.groups())
+    if max_value != 255:
+        return None
 
-        w = int(np.fromfile(f, "<i4", count=1))
-        h = int(np.fromfile(f, "<i4", count=1))
-        data = np.fromfile(f, "<f4", count=2 * w * h)
-        return data.reshape(h, w, 2).transpose(2, 0, 1)
+    start, end = header_match.end(), header_match.end() + 3 * w * h
+    if len(content) < end:
+        raise ValueError("Truncated PPM file")
+    return Image.frombuffer("RGB", (w, h), memoryview(content)[start:end], "raw", "RGB", 0, 1)
 
 
 def _read_16bits_png_with_flow_and_valid_mask(file_name):
 
-    flow_and_valid = _read_png_16(file_name).to(torch.float32)
-    flow, valid_flow_mask = flow_and_valid[:2, :, :], flow_and_valid[2, :, :]
-    flow = (flow - 2 ** 15) / 64  # This conversion is explained somewhere on the kitti archive
-    valid_flow_mask = valid_flow_mask.bool()
+    flow_and_valid = _read_png_16(file_name)
+    # Only the flow channels are converted to float, and the conversion is done in-place to avoid temporaries.
+    # This conversion is explained somewhere on the kitti archive
+    flow = flow_and_valid[:2, :, :].to(torch.float32).sub_(2 ** 15).div_(64)
+    valid_flow_mask = flow_and_valid[2, :, :].bool()
 
     # For consistency with other datasets, we convert to numpy
     return flow.numpy(), valid_flow_mask.numpy()